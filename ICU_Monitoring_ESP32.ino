@@ -6,7 +6,8 @@
 #include "feature_constants.h"
 
 // TensorFlow Lite for Microcontrollers
-#include <tensorflow/lite/micro/all_ops_resolver.h>
+// On ESP32-S3, build esp-tflite-micro with CONFIG_NN_OPTIMIZED=y to use the ESP-NN SIMD kernels
+#include <tensorflow/lite/micro/micro_mutable_op_resolver.h>
 #include <tensorflow/lite/micro/micro_interpreter.h>
 #include <tensorflow/lite/schema/schema_generated.h>
 
@@ -44,6 +45,7 @@ String fluid_condition = "Initializing";
 String heart_condition = "Initializing";
 bool fluid_inlet_control = false;
 unsigned long last_prediction_time = 0;
+float last_confidence = 0;
 const unsigned long PREDICTION_INTERVAL = 10000;
 
 // Health status labels
@@ -262,7 +264,10 @@ void load_model() {
     while(1);
   }
   
-  static tflite::AllOpsResolver resolver;
+  // Only the builtin ops the Dense/Softmax model uses (no flex ops)
+  static tflite::MicroMutableOpResolver<2> resolver;
+  resolver.AddFullyConnected();
+  resolver.AddSoftmax();
   static tflite::MicroInterpreter static_interpreter(model, resolver, tensor_arena, tensor_arena_size);
   interpreter = &static_interpreter;
   
@@ -277,9 +282,10 @@ void load_model() {
 }
 
 int predict_health() {
-  // Scale features for ML model
+  // Scale and quantize features for the int8 ML model (constants pre-folded)
   for (int i = 0; i < num_features; i++) {
-    input->data.f[i] = (current_sensor_data[i] - feature_means[i]) / feature_stds[i];
+    int q = (int)roundf(current_sensor_data[i] * feature_multipliers[i] + feature_offsets[i]);
+    input->data.int8[i] = (int8_t)constrain(q, -128, 127);
   }
   
   TfLiteStatus invoke_status = interpreter->Invoke();
@@ -289,13 +295,15 @@ int predict_health() {
   }
   
   int prediction = 0;
-  float max_prob = output->data.f[0];
+  int8_t max_q = output->data.int8[0];
   for (int i = 1; i < 3; i++) {
-    if (output->data.f[i] > max_prob) {
-      max_prob = output->data.f[i];
+    if (output->data.int8[i] > max_q) {
+      max_q = output->data.int8[i];
       prediction = i;
     }
   }
+  float max_prob = (max_q - output->params.zero_point) * output->params.scale;
+  last_confidence = max_prob;
   
   health_status = HEALTH_LABELS[prediction];
   Serial.print("ML Prediction: ");
@@ -590,11 +598,7 @@ void setup_webserver() {
     
 
     if (output != nullptr) {
-      float max_prob = 0;
-      for (int i = 0; i < 3; i++) {
-        if (output->data.f[i] > max_prob) max_prob = output->data.f[i];
-      }
-      doc["confidence"] = max_prob;
+      doc["confidence"] = last_confidence;
     }
     
     String response;
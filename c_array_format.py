@@ -0,0 +1,12 @@
+# c_array_format.py - Format model bytes as C array lines
+# Kept free of TensorFlow so multiprocessing workers start quickly
+import numpy as np
+
+# 16-byte rows (4 x uint32) to match the ESP32 flash cache
+WORDS_PER_LINE = 4
+
+def format_c_lines(words):
+    # One "    0x..., 0x...,\n" line per WORDS_PER_LINE words
+    tokens = np.char.mod("0x%08x", words)
+    return "".join("    " + ", ".join(tokens[i:i+WORDS_PER_LINE]) + ",\n"
+                   for i in range(0, len(tokens), WORDS_PER_LINE))
@@ -1,38 +1,68 @@
 # convert_model.py - Convert model for ESP32
 import tensorflow as tf
 import numpy as np
-import joblib
 import pandas as pd
 import os
+import multiprocessing
+from c_array_format import WORDS_PER_LINE, format_c_lines
 
-print("Converting Model for ESP32")
-print("=" * 40)
+# Output files for each conversion precision (fp16 is host-side only:
+# the TFLM DEQUANTIZE kernel can't expand float16 weights on the ESP32)
+TFLITE_PATHS = {
+    'int8': 'icu_health_model.tflite',
+    'fp16': 'icu_health_model_fp16.tflite'
+}
 
-def convert_to_tflite():
+# Model size above which C array formatting is parallelized. Each spawned
+# worker re-imports this script (and TensorFlow), so below this the pool
+# costs more than the formatting it saves
+PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+
+def convert_to_tflite(df, feature_columns, feature_stats, precision='int8'):
     print("\nStep 1: Loading trained model...")
     
-    if not os.path.exists('icu_health_model.h5'):
+    if not os.path.isdir('icu_saved_model'):
         print("Error: No trained model found!")
         print("   Run 'python train_model.py' first")
         return None
     
-    model = tf.keras.models.load_model('icu_health_model.h5')
+    # Convert straight from the SavedModel, no Keras deserialization
+    # export() writes 'serve' and 'serving_default' for the same function;
+    # convert only one so the flatbuffer holds a single subgraph
+    converter = tf.lite.TFLiteConverter.from_saved_model(
+        'icu_saved_model', signature_keys=['serving_default']
+    )
     print("Model loaded successfully")
     
-    print("\nStep 2: Converting to TensorFlow Lite...")
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    print(f"\nStep 2: Converting to TensorFlow Lite ({precision})...")
     converter.optimizations = [tf.lite.Optimize.DEFAULT]
     
-    # ESP32 compatibility
-    converter.target_spec.supported_ops = [
-        tf.lite.OpsSet.TFLITE_BUILTINS,
-        tf.lite.OpsSet.SELECT_TF_OPS
-    ]
+    if precision == 'fp16':
+        # Half-size float weights, no calibration needed
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # Calibration samples for full-integer quantization
+        samples = df[feature_columns].sample(min(200, len(df)), random_state=0)
+        calibration_data = (samples.values - feature_stats['means']) / feature_stats['stds']
+        calibration_data = np.ascontiguousarray(calibration_data, dtype=np.float32)
+        
+        # Calibration data is scaled once; each pass just yields slices
+        def representative_dataset():
+            for i in range(len(calibration_data)):
+                yield [calibration_data[i:i+1]]
+        
+        converter.representative_dataset = representative_dataset
+        
+        # ESP32 compatibility: int8 builtin kernels only, int8 in and out
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
     
     tflite_model = converter.convert()
     
     # Save TFLite model
-    with open('icu_health_model.tflite', 'wb') as f:
+    with open(TFLITE_PATHS[precision], 'wb') as f:
         f.write(tflite_model)
     
     print(f"TensorFlow Lite model saved! Size: {len(tflite_model)} bytes")
@@ -41,53 +71,76 @@ def convert_to_tflite():
 def convert_to_c_array(tflite_model):
     print("\nStep 3: Converting to C array for ESP32...")
     
-    # Convert to hex array
-    hex_array = []
-    for byte in tflite_model:
-        hex_array.append(f"0x{byte:02x}")
-    
-    # Create C header file
-    c_code = "// ICU Health Monitoring Model - Auto-generated\n"
-    c_code += "// TensorFlow Lite model for ESP32\n\n"
-    c_code += "#ifndef MODEL_DATA_H\n#define MODEL_DATA_H\n\n"
-    c_code += "const unsigned char model_data[] = {\n"
-    
-    # Format with 12 bytes per line
-    for i in range(0, len(hex_array), 12):
-        c_code += "    " + ", ".join(hex_array[i:i+12]) + ",\n"
-    
-    c_code = c_code.rstrip(",\n") + "\n};\n\n"
-    c_code += f"const int model_data_len = {len(tflite_model)};\n\n"
-    c_code += "#endif // MODEL_DATA_H\n"
-    
-    with open('model_data.h', 'w') as f:
-        f.write(c_code)
+    # Pack the model into little-endian 32-bit words (zero-padded), which
+    # keeps the bytes in order on the little-endian ESP32. "0x%08x, " is 3
+    # characters per byte vs 6 for "0xNN, ", so the header is about half the size
+    padded = tflite_model + b"\x00" * (-len(tflite_model) % 4)
+    words = np.frombuffer(padded, dtype='<u4')
+    
+    # Split on line boundaries; huge models are formatted across processes
+    n_chunks = (os.cpu_count() or 1) if len(tflite_model) > PARALLEL_MIN_BYTES else 1
+    n_lines = -(-len(words) // WORDS_PER_LINE)
+    chunk_words = -(-n_lines // n_chunks) * WORDS_PER_LINE
+    chunks = [words[i:i+chunk_words] for i in range(0, len(words), chunk_words)]
+    if len(chunks) > 1:
+        # spawn: never fork a process that already runs TensorFlow threads
+        with multiprocessing.get_context('spawn').Pool(len(chunks)) as pool:
+            parts = pool.map(format_c_lines, chunks)
+    else:
+        parts = [format_c_lines(chunk) for chunk in chunks]
+    
+    # Write the C header line by line instead of building one big string
+    with open('model_data.h', 'w', buffering=1 << 16) as f:
+        f.write("// ICU Health Monitoring Model - Auto-generated\n")
+        f.write("// TensorFlow Lite model for ESP32\n\n")
+        f.write("#ifndef MODEL_DATA_H\n#define MODEL_DATA_H\n\n")
+        f.write("#include <stdint.h>\n\n")
+        f.write("alignas(16) const uint32_t model_data_u32[] = {\n")
+        
+        # Write the formatted parts in order (no trailing comma on the last line)
+        for part in parts[:-1]:
+            f.write(part)
+        f.write(parts[-1][:-2] + "\n")
+        
+        f.write("};\n\n")
+        f.write("const unsigned char* const model_data =\n")
+        f.write("    reinterpret_cast<const unsigned char*>(model_data_u32);\n\n")
+        f.write(f"const int model_data_len = {len(tflite_model)};\n\n")
+        f.write("#endif // MODEL_DATA_H\n")
     
-    print(f"C header file created: {len(hex_array)} bytes")
+    print(f"C header file created: {len(tflite_model)} bytes")
     print("   File: model_data.h")
 
-def generate_arduino_constants():
+def _scaling_constants(feature_stats, input_scale, input_zero_point):
+    # Fold standardization into the model's input quantization:
+    # q = (x - mean) / std / scale + zero_point = x * multiplier + offset
+    multipliers = 1.0 / (feature_stats['stds'] * input_scale)
+    offsets = input_zero_point - feature_stats['means'] * multipliers
+    
+    # Feature multipliers (1 / (std * input scale))
+    c_code = "const float feature_multipliers[] = {\n    "
+    c_code += ", ".join(np.char.mod("%.6ef", multipliers))
+    c_code += "\n};\n"
+    
+    # Feature offsets (zero point - mean * multiplier)
+    c_code += "const float feature_offsets[] = {\n    "
+    c_code += ", ".join(np.char.mod("%.6ef", offsets))
+    c_code += "\n};\n"
+    return c_code
+
+def generate_arduino_constants(feature_stats, int8_model):
     print("\nStep 4: Generating Arduino constants...")
     
-    if not os.path.exists('feature_stats.pkl'):
-        print("Feature statistics not found!")
-        return
-    
-    feature_stats = joblib.load('feature_stats.pkl')
-    
     arduino_code = "// Feature scaling constants for ESP32\n"
-    arduino_code += "// Auto-generated from Python training\n\n"
+    arduino_code += "// Auto-generated from Python training\n"
+    arduino_code += "// Model input = sensor value * multiplier + offset\n\n"
     arduino_code += "#ifndef FEATURE_CONSTANTS_H\n#define FEATURE_CONSTANTS_H\n\n"
     
-    # Feature means
-    arduino_code += "const float feature_means[] = {\n    "
-    arduino_code += ", ".join([f"{mean:.6f}f" for mean in feature_stats['means']])
-    arduino_code += "\n};\n\n"
-    
-    # Feature standard deviations
-    arduino_code += "const float feature_stds[] = {\n    "
-    arduino_code += ", ".join([f"{std:.6f}f" for std in feature_stats['stds']])
-    arduino_code += "\n};\n\n"
+    # The int8 model uses its calibrated input quantization
+    interpreter = tf.lite.Interpreter(model_content=int8_model)
+    input_scale, input_zero_point = interpreter.get_input_details()[0]['quantization']
+    arduino_code += _scaling_constants(feature_stats, input_scale, input_zero_point)
+    arduino_code += "\n"
     
     # Feature count
     arduino_code += f"const int num_features = {len(feature_stats['feature_names'])};\n\n"
@@ -98,61 +151,87 @@ def generate_arduino_constants():
     
     print("Arduino constants saved: feature_constants.h")
 
-def test_conversion():
-    print("\nStep 5: Testing converted model...")
-    
-    # Load test data
-    df = pd.read_csv('icu_patient_dataset.csv')
-    feature_columns = joblib.load('feature_columns.pkl')
-    scaler = joblib.load('scaler.pkl')
+def test_conversion(tflite_model, df, feature_columns, feature_stats, precision='int8'):
+    print(f"\nStep 5: Testing converted model ({precision})...")
     
     # Test with 2 samples
     X_test = df[feature_columns].iloc[:2]
-    X_test_scaled = scaler.transform(X_test)
-    
-    # Load TFLite model
-    interpreter = tf.lite.Interpreter(model_path='icu_health_model.tflite')
-    interpreter.allocate_tensors()
+    X_test_scaled = (X_test.values - feature_stats['means']) / feature_stats['stds']
     
+    # Load TFLite model, sized to run the whole batch in one invoke
+    # num_threads lets TF pick the XNNPACK delegate for the CPU kernels
+    interpreter = tf.lite.Interpreter(model_content=tflite_model,
+                                      num_threads=os.cpu_count())
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
+    interpreter.resize_tensor_input(input_details[0]['index'], list(X_test_scaled.shape))
+    interpreter.allocate_tensors()
+    
+    # Zero-copy view of the output tensor, valid until the next invoke
+    output_tensor = interpreter.tensor(output_details[0]['index'])
+    
+    if input_details[0]['dtype'] == np.int8:
+        # Quantize inputs with the model's int8 input parameters
+        input_scale, input_zero_point = input_details[0]['quantization']
+        input_data = np.round(X_test_scaled / input_scale + input_zero_point)
+        input_data = np.clip(input_data, -128, 127).astype(np.int8)
+    else:
+        input_data = X_test_scaled.astype(np.float32)
+    
+    interpreter.set_tensor(input_details[0]['index'], input_data)
+    interpreter.invoke()
+    predictions = np.argmax(output_tensor(), axis=1)
     
     print("Testing TFLite model:")
-    for i in range(len(X_test_scaled)):
-        input_data = X_test_scaled[i:i+1].astype(np.float32)
-        interpreter.set_tensor(input_details[0]['index'], input_data)
-        interpreter.invoke()
-        output_data = interpreter.get_tensor(output_details[0]['index'])
-        prediction = np.argmax(output_data, axis=1)[0]
+    status_names = {0: 'Normal', 1: 'Recovery', 2: 'Serious'}
+    for i, prediction in enumerate(predictions):
         actual = df['overall_health_status'].iloc[i]
-        
-        status_names = {0: 'Normal', 1: 'Recovery', 2: 'Serious'}
         match = "Match" if prediction == actual else "Mismatch"
         print(f"   Sample {i+1}: {status_names[prediction]} vs {status_names[actual]} {match}")
 
-if __name__ == "__main__":
+def main():
+    print("Converting Model for ESP32")
+    print("=" * 40)
     print("Starting model conversion process...")
     
-    # Convert to TFLite
-    tflite_model = convert_to_tflite()
-    if tflite_model is None:
-        exit()
+    if not os.path.exists('feature_stats.npz'):
+        print("Feature statistics not found!")
+        print("   Run 'python train_model.py' first")
+        return
+    
+    # Load the training artifacts once and share them between the steps
+    df = pd.read_csv('icu_patient_dataset.csv')
+    with np.load('feature_stats.npz') as stats:
+        feature_stats = dict(stats)
+    feature_columns = feature_stats['feature_names'].tolist()
+    
+    tflite_models = {}
+    for precision in ('int8', 'fp16'):
+        # Convert to TFLite
+        tflite_models[precision] = convert_to_tflite(df, feature_columns, feature_stats, precision)
+        if tflite_models[precision] is None:
+            return
     
-    # Convert to C array
-    convert_to_c_array(tflite_model)
+    # Convert the int8 model to a C array
+    convert_to_c_array(tflite_models['int8'])
     
     # Generate Arduino constants
-    generate_arduino_constants()
+    generate_arduino_constants(feature_stats, tflite_models['int8'])
     
     # Test conversion
-    test_conversion()
+    for precision, tflite_model in tflite_models.items():
+        test_conversion(tflite_model, df, feature_columns, feature_stats, precision)
     
     print("\n" + "="*40)
     print("CONVERSION COMPLETED!")
     print("="*40)
     print("\nFiles for ESP32:")
-    print("   model_data.h - Model as C array")
+    print("   model_data.h - Model as C array (int8)")
     print("   feature_constants.h - Scaling constants")
-    print("   icu_health_model.tflite - TensorFlow Lite model")
+    print("   icu_health_model.tflite - TensorFlow Lite model (int8)")
+    print("   icu_health_model_fp16.tflite - TensorFlow Lite model (fp16, host-side reference)")
     
     print("\nNext: Copy these files to your ESP32 Arduino project")
+
+if __name__ == "__main__":
+    main()
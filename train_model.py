@@ -3,12 +3,15 @@ import pandas as pd
 import numpy as np
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import classification_report, confusion_matrix
-import joblib
-import matplotlib.pyplot as plt
+import argparse
 import os
 
+parser = argparse.ArgumentParser(description="Train the ICU health monitoring model")
+parser.add_argument('--plot', action='store_true',
+                    help="save the training history plot to training_results.png")
+args = parser.parse_args()
+
 print("ICU Health Monitoring - ML Model Training")
 print("=" * 50)
 
@@ -82,9 +85,12 @@ print(f"Testing set: {X_test.shape[0]} records")
 
 # Step 5: Scale features
 print("\nStep 5: Scaling features...")
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
+# Standardize with the training set mean/std (constant columns keep std 1)
+feature_means = X_train.values.mean(axis=0)
+feature_stds = X_train.values.std(axis=0)
+feature_stds[feature_stds == 0] = 1.0
+X_train_scaled = (X_train.values - feature_means) / feature_stds
+X_test_scaled = (X_test.values - feature_means) / feature_stds
 
 print("Features scaled successfully")
 
@@ -93,15 +99,7 @@ print("\nStep 6: Building neural network...")
 
 def create_simple_model(input_dim):
     model = tf.keras.Sequential([
-        tf.keras.layers.Dense(32, activation='relu', input_shape=(input_dim,)),
-        tf.keras.layers.Dropout(0.3),
-        
-        tf.keras.layers.Dense(16, activation='relu'),
-        tf.keras.layers.Dropout(0.3),
-        
-        tf.keras.layers.Dense(8, activation='relu'),
-        tf.keras.layers.Dropout(0.2),
-        
+        tf.keras.layers.Dense(16, activation='relu6', input_shape=(input_dim,)),
         tf.keras.layers.Dense(3, activation='softmax')
     ])
     
@@ -124,12 +122,28 @@ model.summary()
 print("\nStep 7: Training model...")
 print("This may take 1-2 minutes...")
 
-# Simple training without callbacks for beginners
+# Input pipeline: hold out the last 20% for validation (as validation_split did)
+# and prefetch batches so Keras never waits on NumPy slicing
+val_size = int(len(X_train_scaled) * 0.2)
+fit_size = len(X_train_scaled) - val_size
+train_ds = (tf.data.Dataset.from_tensor_slices((X_train_scaled[:fit_size], y_train.values[:fit_size]))
+            .shuffle(fit_size, seed=42)
+            .batch(32)
+            .prefetch(tf.data.AUTOTUNE))
+val_ds = (tf.data.Dataset.from_tensor_slices((X_train_scaled[fit_size:], y_train.values[fit_size:]))
+          .batch(256)
+          .prefetch(tf.data.AUTOTUNE))
+
+# Stop once validation loss stops improving and keep the best weights
+early_stopping = tf.keras.callbacks.EarlyStopping(
+    monitor='val_loss', patience=5, restore_best_weights=True
+)
+
 history = model.fit(
-    X_train_scaled, y_train,
+    train_ds,
     epochs=50,
-    batch_size=16,
-    validation_split=0.2,
+    validation_data=val_ds,
+    callbacks=[early_stopping],
     verbose=1
 )
 
@@ -153,49 +167,44 @@ print(classification_report(y_test, y_pred_classes,
 print("\nStep 9: Saving model and artifacts...")
 
 # Save model
-model.save('icu_health_model.h5')
-print("Model saved as 'icu_health_model.h5'")
-
-# Save scaler
-joblib.dump(scaler, 'scaler.pkl')
-print("Scaler saved as 'scaler.pkl'")
-
-# Save feature list
-joblib.dump(available_features, 'feature_columns.pkl')
-print("Feature columns saved as 'feature_columns.pkl'")
-
-# Save feature statistics for ESP32
-feature_stats = {
-    'means': scaler.mean_.tolist(),
-    'stds': scaler.scale_.tolist(),
-    'feature_names': available_features
-}
-joblib.dump(feature_stats, 'feature_stats.pkl')
-print("Feature statistics saved as 'feature_stats.pkl'")
-
-# Create training plot
-print("\nCreating training history plot...")
-plt.figure(figsize=(10, 4))
-
-plt.subplot(1, 2, 1)
-plt.plot(history.history['accuracy'], label='Training Accuracy')
-plt.plot(history.history['val_accuracy'], label='Validation Accuracy')
-plt.title('Model Accuracy')
-plt.ylabel('Accuracy')
-plt.xlabel('Epoch')
-plt.legend()
-
-plt.subplot(1, 2, 2)
-plt.plot(history.history['loss'], label='Training Loss')
-plt.plot(history.history['val_loss'], label='Validation Loss')
-plt.title('Model Loss')
-plt.ylabel('Loss')
-plt.xlabel('Epoch')
-plt.legend()
-
-plt.tight_layout()
-plt.savefig('training_results.png', dpi=300, bbox_inches='tight')
-print("Training plot saved as 'training_results.png'")
+model.export('icu_saved_model')
+print("Model saved as 'icu_saved_model' (SavedModel)")
+
+# Save feature names and statistics (used for scaling here and on the ESP32)
+np.savez('feature_stats.npz',
+         means=feature_means,
+         stds=feature_stds,
+         feature_names=np.array(available_features))
+print("Feature statistics saved as 'feature_stats.npz'")
+
+# Create training plot (matplotlib is only imported when asked for)
+if args.plot:
+    print("\nCreating training history plot...")
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 4))
+
+    plt.subplot(1, 2, 1)
+    plt.plot(history.history['accuracy'], label='Training Accuracy')
+    plt.plot(history.history['val_accuracy'], label='Validation Accuracy')
+    plt.title('Model Accuracy')
+    plt.ylabel('Accuracy')
+    plt.xlabel('Epoch')
+    plt.legend()
+
+    plt.subplot(1, 2, 2)
+    plt.plot(history.history['loss'], label='Training Loss')
+    plt.plot(history.history['val_loss'], label='Validation Loss')
+    plt.title('Model Loss')
+    plt.ylabel('Loss')
+    plt.xlabel('Epoch')
+    plt.legend()
+
+    plt.tight_layout()
+    plt.savefig('training_results.png', dpi=100, bbox_inches='tight')
+    print("Training plot saved as 'training_results.png'")
 
 # Step 10: Test with samples
 print("\nStep 10: Testing with sample data...")
@@ -203,7 +212,7 @@ print("Sample predictions (first 5 records):")
 
 for i in range(min(5, len(X_test))):
     sample_data = X_test.iloc[i:i+1]
-    sample_scaled = scaler.transform(sample_data)
+    sample_scaled = (sample_data.values - feature_means) / feature_stds
     prediction = model.predict(sample_scaled, verbose=0)
     predicted_class = np.argmax(prediction, axis=1)[0]
     actual_class = y_test.iloc[i]
@@ -217,11 +226,10 @@ print("\n" + "="*50)
 print("TRAINING COMPLETED SUCCESSFULLY!")
 print("="*50)
 print("\nGenerated Files:")
-print("   icu_health_model.h5 - Main model file")
-print("   scaler.pkl - Feature scaler")
-print("   feature_columns.pkl - Feature names")
-print("   feature_stats.pkl - Statistics")
-print("   training_results.png - Training history plot")
+print("   icu_saved_model/ - Main model (SavedModel)")
+print("   feature_stats.npz - Feature names and statistics")
+if args.plot:
+    print("   training_results.png - Training history plot")
 
 print(f"\nFinal Model Accuracy: {test_accuracy*100:.2f}%")
 